@@ -101,10 +101,13 @@ Example:
   >>> nngp_train_train_diag = nngp_fn(x_train, None, params)
 """
 
+import bisect
 import enum
 import functools
+import itertools
+import math
 import operator
-from typing import Callable, Iterable, KeysView, Optional, TypeVar, Union
+from typing import Callable, Iterable, KeysView, Optional, Sequence, TypeVar, Union
 import warnings
 
 import jax
@@ -2318,11 +2321,17 @@ def _get_flops(f: Callable, optimize: bool, *a, **kw) -> float:
 
 def _std_basis(pytree: PyTree) -> PyTree:
   """Similar to `jax.api._std_basis` without host-side ops."""
-  leaves, _ = tree_flatten(pytree)
-  ndim = sum(map(jnp.size, leaves))
+  leaves, treedef = tree_flatten(pytree)
+  shapes = [jnp.shape(l) for l in leaves]
+  sizes = [math.prod(s) for s in shapes]
+  ndim = sum(sizes)
   dtype = jax.dtypes.result_type(*leaves)
-  flat_basis = jnp.eye(ndim, dtype=dtype)
-  return _unravel_array_into_pytree(pytree, 1, flat_basis)
+  # Build each leaf's slice of the identity directly instead of splitting a
+  # full `ndim x ndim` identity matrix.
+  offsets = itertools.accumulate(sizes[:-1], initial=0)
+  basis = [jnp.eye(ndim, size, -offset, dtype).reshape((ndim,) + shape)
+           for shape, size, offset in zip(shapes, sizes, offsets)]
+  return tree_unflatten(treedef, basis)
 
 
 def _unravel_array_into_pytree(
@@ -2334,9 +2343,10 @@ def _unravel_array_into_pytree(
   leaves, treedef = tree_flatten(pytree)
   if arr.ndim > 0:
     axis %= arr.ndim
-  shapes = [arr.shape[:axis] + jnp.shape(l) + arr.shape[axis + 1:]
-            for l in leaves]
-  parts = jnp.split(arr, np.cumsum([jnp.size(l) for l in leaves[:-1]]), axis)
+  leaf_shapes = [jnp.shape(l) for l in leaves]
+  shapes = [arr.shape[:axis] + s + arr.shape[axis + 1:] for s in leaf_shapes]
+  split_points = list(itertools.accumulate(map(math.prod, leaf_shapes[:-1])))
+  parts = jnp.split(arr, split_points, axis)
   reshaped_parts = [jnp.reshape(x, shape) for x, shape in zip(parts, shapes)]
   return tree_unflatten(treedef, reshaped_parts)
 
@@ -2345,12 +2355,10 @@ def _get_res_batch_dims(
     contracting_dims: Iterable[int],
     batch_dims: Iterable[int]
 ) -> list[int]:
-  res_batch_dims = [2 * b - i for i, b in enumerate(batch_dims)]
-  for i, b in enumerate(batch_dims):
-    for c in contracting_dims:
-      if b > c:
-        res_batch_dims[i] -= 2
-  return res_batch_dims
+  contracting_dims = sorted(contracting_dims)
+  # Each contracting dimension preceding `b` shifts it by 2 in the result.
+  return [2 * (b - bisect.bisect_left(contracting_dims, b)) - i
+          for i, b in enumerate(batch_dims)]
 
 
 def _dot_general(
@@ -2393,8 +2401,22 @@ def _dot_general(
                        (batch_dims, batch_dims))
 
   prod = lax.dot_general(lhs, rhs, dimension_numbers, precision)
-  prod = utils.zip_axes(prod, n_batch_dims)
 
+  # Zip the non-batch axes and move the batch axes into place in one transpose.
+  zip_perm = utils.zip_axes_permutation(prod.ndim, n_batch_dims)
   res_batch_dims = _get_res_batch_dims(contracting_dims, batch_dims)
-  prod = jnp.moveaxis(prod, leading_batch_dims, res_batch_dims)
-  return prod
+  move_perm = _moveaxis_permutation(prod.ndim, leading_batch_dims,
+                                    res_batch_dims)
+  return lax.transpose(prod, tuple(zip_perm[i] for i in move_perm))
+
+
+def _moveaxis_permutation(
+    ndim: int,
+    source: Sequence[int],
+    destination: Sequence[int]
+) -> tuple[int, ...]:
+  """Returns the permutation done by `jnp.moveaxis` on non-negative axes."""
+  perm = [i for i in range(ndim) if i not in source]
+  for dst, src in sorted(zip(destination, source)):
+    perm.insert(dst, src)
+  return tuple(perm)
@@ -1348,18 +1348,27 @@ def _get_attr(k, g: str) -> jnp.ndarray:
 
 
 def _is_on_cpu(x: PyTree) -> bool:
-  def _arr_is_on_cpu(x: jnp.ndarray) -> bool:
-    # TODO(romann): revisit when https://github.com/google/jax/issues/1431 and
-    # https://github.com/google/jax/issues/1432 are fixed.
-    if hasattr(x, 'addressable_shards'):
-      # device_buffer is deprecated, so try addressable_shards first.
-      return 'cpu' in str(x.addressable_shards[0].device).lower()
-    elif hasattr(x, 'device_buffer'):
-      return 'cpu' in str(x.device_buffer.device()).lower()
+  if isinstance(x, (np.ndarray, jnp.ndarray)):
+    # Skip the tree traversal for the common single-array case.
+    return _arr_is_on_cpu(x)
+  return tree_all(tree_map(_arr_is_on_cpu, x))
 
-    if isinstance(x, (np.ndarray, jnp.ndarray)):
-      return True
 
-    raise NotImplementedError(type(x))
+def _arr_is_on_cpu(x: jnp.ndarray) -> bool:
+  # TODO(romann): revisit when https://github.com/google/jax/issues/1431 and
+  # https://github.com/google/jax/issues/1432 are fixed.
+  if hasattr(x, 'addressable_shards'):
+    # device_buffer is deprecated, so try addressable_shards first.
+    return _device_is_cpu(x.addressable_shards[0].device)
+  elif hasattr(x, 'device_buffer'):
+    return _device_is_cpu(x.device_buffer.device())
 
-  return tree_all(tree_map(_arr_is_on_cpu, x))
+  if isinstance(x, (np.ndarray, jnp.ndarray)):
+    return True
+
+  raise NotImplementedError(type(x))
+
+
+@lru_cache(maxsize=None)
+def _device_is_cpu(device) -> bool:
+  return 'cpu' in str(device).lower()
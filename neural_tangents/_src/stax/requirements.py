@@ -356,11 +356,16 @@ def _get_masked_array(
   elif isinstance(x, (np.ndarray, jnp.ndarray, float, int)):
     if mask_constant is None:
       mask_mat = None
-    else:
+    elif isinstance(mask_constant, jax.core.Tracer):
       mask_mat = lax.cond(jnp.isnan(mask_constant),
                           jnp.isnan,
                           lambda x: x == mask_constant,
                           x)
+    elif np.isnan(mask_constant):
+      # Concrete `mask_constant` - pick the branch in Python to avoid `cond`.
+      mask_mat = jnp.isnan(x)
+    else:
+      mask_mat = x == mask_constant
   else:
     raise TypeError(x, type(x))
 
@@ -70,20 +70,26 @@ def dataclass(clz):
       else:
         meta_fields.append(name)
 
-  def iterate_clz(x):
-    meta = tuple(getattr(x, name) for name in meta_fields)
-    data = tuple(getattr(x, name) for name in data_fields)
-    return data, meta
-
-  def clz_from_iterable(meta, data):
-    meta_args = tuple(zip(meta_fields, meta))
-    data_args = tuple(zip(data_fields, data))
-    kwargs = dict(meta_args + data_args)
-    return data_clz(**kwargs)
-
-  jax.tree_util.register_pytree_node(data_clz,
-                                     iterate_clz,
-                                     clz_from_iterable)
+  if hasattr(jax.tree_util, 'register_dataclass'):
+    # Newer JAX versions flatten/unflatten registered dataclasses in C++.
+    jax.tree_util.register_dataclass(data_clz,
+                                     data_fields=data_fields,
+                                     meta_fields=meta_fields)
+  else:
+    def iterate_clz(x):
+      meta = tuple(getattr(x, name) for name in meta_fields)
+      data = tuple(getattr(x, name) for name in data_fields)
+      return data, meta
+
+    def clz_from_iterable(meta, data):
+      meta_args = tuple(zip(meta_fields, meta))
+      data_args = tuple(zip(data_fields, data))
+      kwargs = dict(meta_args + data_args)
+      return data_clz(**kwargs)
+
+    jax.tree_util.register_pytree_node(data_clz,
+                                       iterate_clz,
+                                       clz_from_iterable)
 
   @functools.wraps(
       dataclasses.replace,
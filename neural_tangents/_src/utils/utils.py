@@ -20,17 +20,22 @@ If a function or class is used in multiple modules, put it here.
 from collections import namedtuple
 import functools
 import inspect
-import operator
+import math
 import types
 from typing import Any, Callable, Iterable, Optional, Sequence, Sized, TypeVar, Union
 import warnings
 
 import jax
 from jax import core
+from jax import lax
 from jax import random
 import jax.numpy as jnp
 from jax.tree_util import tree_all
+from jax.tree_util import tree_flatten
+from jax.tree_util import tree_leaves
 from jax.tree_util import tree_map
+from jax.tree_util import tree_structure
+from jax.tree_util import tree_unflatten
 import numpy as np
 
 
@@ -46,6 +51,10 @@ def is_list_or_tuple(x) -> bool:
   return type(x) == list or type(x) == tuple
 
 
+def _is_nt_leaf(x) -> bool:
+  return not is_list_or_tuple(x)
+
+
 def is_nt_tree_of(x, dtype: Union[type, tuple[type, ...]]) -> bool:
   if isinstance(x, dtype):
     return True
@@ -57,7 +66,7 @@ def is_nt_tree_of(x, dtype: Union[type, tuple[type, ...]]) -> bool:
 def nt_tree_fn(
     nargs: Optional[int] = None,
     tree_structure_argnum: Optional[int] = None,
-    reduce: Callable = lambda x: x
+    reduce: Optional[Callable] = None
 ):
   """Convert a function that acts on single inputs to one that acts on trees.
 
@@ -83,33 +92,18 @@ def nt_tree_fn(
 
     reduce:
       A callable that is applied recursively by each internal tree node to its
-      children.
+      children. `None` means no reduction.
 
   Returns:
     A decorator `tree_fn` that transforms a function, `fn`, from acting on
     leaves to acting on NTTrees.
   """
 
-  def check_tree_structure(args):
-    """Ensure the structure of the trees in each of the `nargs` is the same."""
-    if any(is_list_or_tuple(x) for x in args):
-      if not all(type(x) == type(args[0]) for x in args[1:]):
-        raise TypeError(f'Inconsistent NTTree structure found. '
-                        f'Node Types: {[type(x) for x in args]}.')
-
-      """
-        Regarding the use of zip, consider an example `x1 = x2 = (1, (1, 1))`.
-        We would like to determine whether these two trees have the same
-        structure.
-
-        On the first recurrence `x1` and `x2` are both tuples so the check
-        passes and `zip(*args) = [(1, 1), ((1, 1), (1, 1))]` so that
-        `(check_tree_structure(x) for x in zip(x1, x2))` will first check that
-        the first element of `x1` has the same tree structure as the first
-        element of `x2` and then the second element and so on.
-      """
-      for x in zip(*args):
-        check_tree_structure(x)
+  def reduce_tree(node, outputs):
+    """Rebuild the tree of `node` from `outputs`, reducing at each node."""
+    if not is_list_or_tuple(node):
+      return next(outputs)
+    return reduce(type(node)(reduce_tree(x, outputs) for x in node))
 
   def tree_fn(fn):
     @wraps(fn)
@@ -117,26 +111,57 @@ def nt_tree_fn(
       _nargs = len(args) if nargs is None else nargs
       recurse, norecurse = args[:_nargs], args[_nargs:]
 
-      structure_argnum = tree_structure_argnum
-      if structure_argnum is None:
-        check_tree_structure(recurse)
-        structure_argnum = 0
+      if tree_structure_argnum is None:
+        if not any(is_list_or_tuple(x) for x in recurse):
+          return fn(*args, **kwargs)
+
+        # Flatten all trees once and ensure they have the same structure.
+        leaves, treedefs = zip(*(tree_flatten(x, is_leaf=_is_nt_leaf)
+                                 for x in recurse))
+        treedef = treedefs[0]
+        if any(t != treedef for t in treedefs[1:]):
+          raise TypeError(f'Inconsistent NTTree structure found. '
+                          f'Tree structures: {treedefs}.')
+        structure = args[0]
+
+      else:
+        structure = args[tree_structure_argnum]
+        if not is_list_or_tuple(structure):
+          return fn(*args, **kwargs)
+
+        treedef = tree_structure(structure, is_leaf=_is_nt_leaf)
+        leaves = [treedef.flatten_up_to(x) for x in recurse]
+
+      outputs = [fn(*(xs + norecurse), **kwargs) for xs in zip(*leaves)]
+      if reduce is None:
+        return tree_unflatten(treedef, outputs)
+      return reduce_tree(structure, iter(outputs))
 
-      if is_list_or_tuple(args[structure_argnum]):
-        list_or_tuple = type(args[structure_argnum])
-        return reduce(list_or_tuple(
-            wrapped_fn(*(xs + norecurse), **kwargs) for xs in zip(*recurse)))
-      return fn(*args, **kwargs)
     return wrapped_fn
   return tree_fn
 
 
 def all_none(x, attr: Optional[str] = None) -> bool:
+  # Fast paths for non-tree inputs.
+  if x is None:
+    return True
+  if attr is None and isinstance(x, (np.ndarray, jnp.ndarray)):
+    return False
+
   get_fn = (lambda x: x) if attr is None else lambda x: getattr(x, attr)
   return tree_all(tree_map(lambda x: get_fn(x) is None, x))
 
 
 def canonicalize_get(get):
+  if isinstance(get, str) or (
+      isinstance(get, tuple) and all(isinstance(g, str) for g in get)):
+    # Hashable (and by far the most common) case, see `_canonicalize_get`.
+    return _canonicalize_get(get)
+  return _canonicalize_get.__wrapped__(get)
+
+
+@functools.lru_cache(maxsize=128)
+def _canonicalize_get(get):
   if get is None:
     return True, get
 
@@ -155,16 +180,9 @@ def canonicalize_get(get):
   return get_is_not_tuple, get
 
 
-_KERNEL_NAMED_TUPLE_CACHE: dict[Any, Any] = {}
-
-
+@functools.lru_cache(maxsize=None)
 def _named_tuple_factory(name, get):
-  key = (name, get)
-  if key in _KERNEL_NAMED_TUPLE_CACHE:
-    return _KERNEL_NAMED_TUPLE_CACHE[key]
-  else:
-    _KERNEL_NAMED_TUPLE_CACHE[key] = namedtuple(name, get)
-    return _named_tuple_factory(name, get)
+  return namedtuple(name, get)
 
 
 def _output_to_dict(output):
@@ -184,16 +202,40 @@ def _output_to_dict(output):
 
 
 def wraps(f):
-  def wrapper(g):
-    @functools.wraps(f)
-    def h(*args, **kwargs):
-      return g(*args, **kwargs)
+  signature = inspect.signature(f)
 
-    h.__signature__ = inspect.signature(f)
-    return h
+  def wrapper(g):
+    # Update `g` in place rather than wrapping it in another function, to avoid
+    # an extra Python call on every invocation.
+    g = functools.wraps(f)(g)
+    g.__signature__ = signature
+    return g
   return wrapper
 
 
+@nt_tree_fn(nargs=1)
+def _canonicalize_output(out, name, get, get_is_not_tuple):
+  if get is None:
+    if isinstance(out, dict):
+      ReturnType = _named_tuple_factory(name, tuple(out.keys()))
+      out = ReturnType(*out.values())
+    return out
+
+  out = _output_to_dict(out)
+
+  if get_is_not_tuple:
+    if isinstance(out, types.GeneratorType):
+      return (output[get[0]] for output in out)
+    else:
+      return out[get[0]]
+
+  ReturnType = _named_tuple_factory(name, get)
+  if isinstance(out, types.GeneratorType):
+    return (ReturnType(*tuple(output[g] for g in get)) for output in out)
+  else:
+    return ReturnType(*tuple(out[g] for g in get))
+
+
 def get_namedtuple(name):
   def getter_decorator(fn):
     try:
@@ -223,37 +265,42 @@ def get_namedtuple(name):
 
       fn_out = fn(*canonicalized_args, **kwargs)
 
-      @nt_tree_fn()
-      def canonicalize_output(out):
-        if get is None:
-          if isinstance(out, dict):
-            ReturnType = _named_tuple_factory(name, tuple(out.keys()))
-            out = ReturnType(*out.values())
-          return out
+      return _canonicalize_output(fn_out, name, get, get_is_not_tuple)
 
-        out = _output_to_dict(out)
+    return getter_fn
 
-        if get_is_not_tuple:
-          if isinstance(out, types.GeneratorType):
-            return (output[get[0]] for output in out)
-          else:
-            return out[get[0]]
+  return getter_decorator
 
-        ReturnType = _named_tuple_factory(name, get)
-        if isinstance(out, types.GeneratorType):
-          return (ReturnType(*tuple(output[g] for g in get)) for output in out)
-        else:
-          return ReturnType(*tuple(out[g] for g in get))
 
-      return canonicalize_output(fn_out)
+def x1_is_x2(
+    x1: PyTree,
+    x2: Optional[PyTree] = None,
+    eps: float = 1e-12
+) -> Union[bool, jnp.ndarray]:
+  """Checks whether NTTrees of arrays `x1` and `x2` are equal up to `eps`.
 
-    return getter_fn
+  Returns a Python `bool` or a scalar boolean array if `x1` is a single array,
+  and always a scalar boolean array if `x1` is a list / tuple.
+  """
+  if not is_list_or_tuple(x1):
+    return _x1_is_x2(x1, x2, eps)
 
-  return getter_decorator
+  if x2 is None:
+    return jnp.asarray(True)
 
+  leaves = tree_leaves(_x1_is_x2(x1, x2, eps))
+  if any(leaf is False for leaf in leaves):
+    return jnp.asarray(False)
 
-@nt_tree_fn(nargs=2, reduce=lambda x: jnp.all(jnp.array(x)))
-def x1_is_x2(
+  # Combine array leaves on device; Python `True`s need no work.
+  arrays = [leaf for leaf in leaves if leaf is not True]
+  if not arrays:
+    return jnp.asarray(True)
+  return functools.reduce(jnp.logical_and, arrays)
+
+
+@nt_tree_fn(nargs=2)
+def _x1_is_x2(
     x1: jnp.ndarray,
     x2: Optional[jnp.ndarray] = None,
     eps: float = 1e-12
@@ -284,6 +331,15 @@ def x1_is_x2(
 
 def _get_ndim(x: Union[int, Sized, jnp.ndarray]) -> int:
   """Get number of dimensions given number of dimensions / shape / array."""
+  # Fast paths for the most common exact types.
+  t = type(x)
+  if t is int:
+    return x
+  if t is tuple or t is list:
+    return len(x)
+  if t is np.ndarray:
+    return x.ndim
+
   if hasattr(x, 'ndim'):
     n = x.ndim
   elif hasattr(x, '__len__'):
@@ -318,7 +374,10 @@ def canonicalize_axis(
   """
   axis = [axis] if isinstance(axis, int) else list(axis)
   n = _get_ndim(x)
-  return list(set(np.arange(n)[axis]))
+  for a in axis:
+    if not -n <= a < n:
+      raise IndexError(f'Axis {a} is out of bounds for {n} dimensions.')
+  return sorted({a % n for a in axis})
 
 
 def zip_axes(
@@ -384,22 +443,43 @@ def _zip_axes(
   Returns:
     A `jnp.ndarray` with a new shape.
   """
+  return lax.transpose(
+      x, zip_axes_permutation(x.ndim, start_axis, end_axis, unzip))
+
+
+def zip_axes_permutation(
+    ndim: int,
+    start_axis: int = 0,
+    end_axis: Optional[int] = None,
+    unzip: bool = False
+) -> tuple[int, ...]:
+  """Returns the axes permutation performed by `zip_axes` / `unzip_axes`.
+
+  Args:
+    ndim: number of dimensions of the array.
+    start_axis: `int`, number of axis from which to zip/unzip.
+    end_axis: `int`, number of axis until which to zip/unzip.
+    unzip: `bool`, set to `True` to unzip instead of zip.
+
+  Returns:
+    A tuple `perm` such that `lax.transpose(x, perm)` zips/unzips `x`.
+  """
   if end_axis is None:
-    end_axis = x.ndim
+    end_axis = ndim
 
   half_ndim, ragged = divmod(end_axis - start_axis, 2)
   if ragged:
     raise ValueError(
         f'Need even number of axes to zip, got {end_axis - start_axis}.')
 
-  odd_axes = range(start_axis + 1, end_axis, 2)
-  last_axes = range(end_axis - half_ndim, end_axis)
-
   if unzip:
-    x = jnp.moveaxis(x, odd_axes, last_axes)
+    middle = (tuple(range(start_axis, end_axis, 2)) +
+              tuple(range(start_axis + 1, end_axis, 2)))
   else:
-    x = jnp.moveaxis(x, last_axes, odd_axes)
-  return x
+    middle = tuple(a for i in range(start_axis, start_axis + half_ndim)
+                   for a in (i, i + half_ndim))
+
+  return tuple(range(start_axis)) + middle + tuple(range(end_axis, ndim))
 
 
 def diagonal_between(
@@ -430,18 +510,20 @@ def diagonal_between(
 
 
 def zip_flat(x, y):
-  return tuple(c for xy in zip(x, y) for c in xy)
+  x, y = tuple(x), tuple(y)
+  n = min(len(x), len(y))
+  out = [None] * (2 * n)
+  out[::2] = x[:n]
+  out[1::2] = y[:n]
+  return tuple(out)
 
 
 def interleave_ones(x, start_axis, end_axis, x_first):
-  x_axes = x.shape[start_axis:end_axis]
-  ones = (1,) * (end_axis - start_axis)
-  shape = x.shape[:start_axis]
-  if x_first:
-    shape += zip_flat(x_axes, ones)
-  else:
-    shape += zip_flat(ones, x_axes)
-  shape += x.shape[end_axis:]
+  end_axis = min(end_axis, x.ndim)
+  shape = list(x.shape)
+  shape[start_axis:end_axis] = [1] * (2 * (end_axis - start_axis))
+  shape[start_axis + (0 if x_first else 1):2 * end_axis - start_axis:2] = (
+      x.shape[start_axis:end_axis])
   return x.reshape(shape)
 
 
@@ -473,8 +555,7 @@ def reverse_zipped(
                         for j in (i, i + 1))
 
     if isinstance(x, (np.ndarray, jnp.ndarray)):
-      target_axes = range(start_axis, ndim)
-      x = jnp.moveaxis(x, source_axes, target_axes)
+      x = lax.transpose(x, tuple(range(start_axis)) + source_axes)
     else:
       x = x[:start_axis] + type(x)(x[i] for i in source_axes)
   return x
@@ -497,9 +578,9 @@ def size_at(
     x = x.shape
 
   if axes is None:
-    axes = range(len(x))
+    return math.prod(x)
 
-  return functools.reduce(operator.mul, [x[a] for a in axes], 1)
+  return math.prod(x[a] for a in axes)
 
 
 def axis_after_dot(
@@ -543,14 +624,13 @@ def make_2d(
   if end_axis is None:
     end_axis = x.ndim
 
-  x = unzip_axes(x, start_axis, end_axis)
-
-  half_ndim = (end_axis - start_axis) // 2
-  x = x.reshape(x.shape[:start_axis] +
-                (size_at(x.shape[start_axis:start_axis + half_ndim]),
-                 size_at(x.shape[start_axis + half_ndim:end_axis])) +
-                x.shape[end_axis:])
-  return x
+  # Unzip and reshape in a single `lax.reshape` with permuted `dimensions`.
+  perm = zip_axes_permutation(x.ndim, start_axis, end_axis, unzip=True)
+  shape = (x.shape[:start_axis] +
+           (size_at(x, range(start_axis, end_axis, 2)),
+            size_at(x, range(start_axis + 1, end_axis, 2))) +
+           x.shape[end_axis:])
+  return lax.reshape(x, shape, perm)
 
 
 def _read_keys(key, x1, x2):
@@ -589,18 +669,15 @@ def split_kwargs(kwargs, x1=None, x2=None):
        3. else it is copied to kwargs1 and kwargs2.
 
   """
-  kwargs1 = {}
-  kwargs2 = {}
+  kwargs1 = dict(kwargs)
+  kwargs2 = dict(kwargs)
   for k, v in kwargs.items():
-    if x2 is not None and k == 'rng':
-      key1, key2 = _read_keys(v, x1, x2)
-      kwargs1[k] = key1
-      kwargs2[k] = key2
-    elif isinstance(v, tuple) and len(v) == 2:
-      kwargs1[k] = v[0]
-      kwargs2[k] = v[1]
-    else:
-      kwargs1[k] = kwargs2[k] = v
+    if isinstance(v, tuple) and len(v) == 2:
+      kwargs1[k], kwargs2[k] = v
+
+  # Only one key can be an rng key, so handle it outside of the loop.
+  if x2 is not None and 'rng' in kwargs:
+    kwargs1['rng'], kwargs2['rng'] = _read_keys(kwargs['rng'], x1, x2)
 
   return kwargs1, kwargs2
 
@@ -0,0 +1,259 @@
+# Copyright 2026 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for `neural_tangents/_src/utils`."""
+
+from absl.testing import absltest
+import jax
+from jax import config
+import jax.numpy as jnp
+import numpy as np
+from neural_tangents._src.utils import utils
+from neural_tangents._src.utils.kernel import Kernel
+from tests import test_utils
+
+
+config.parse_flags_with_absl()
+config.update('jax_numpy_rank_promotion', 'raise')
+
+
+test_utils.update_test_tolerance()
+
+
+class IsNtTreeOfTest(test_utils.NeuralTangentsTestCase):
+
+  def test_is_nt_tree_of(self):
+    x = jnp.ones((2, 3))
+    for tree, expected in [(x, True),
+                           ((x, x), True),
+                           ([x, (x, [x])], True),
+                           ((), True),
+                           (None, False),
+                           ((x, None), False),
+                           ([1] + [x] * 63, False),
+                           ((x, [x, (1,)]), False)]:
+      with self.subTest(tree=tree):
+        self.assertEqual(utils.is_nt_tree_of(tree, jnp.ndarray), expected)
+
+    self.assertTrue(utils.is_nt_tree_of((1, [2., (None,)]),
+                                        (int, float, type(None))))
+
+
+class NtTreeFnTest(test_utils.NeuralTangentsTestCase):
+
+  def test_leaves(self):
+    add = utils.nt_tree_fn()(lambda x, y: x + y)
+    self.assertEqual(add(1, 2), 3)
+
+    add_one = utils.nt_tree_fn(nargs=0)(lambda x: x + 1)
+    self.assertEqual(add_one(1), 2)
+
+  def test_mixed_list_tuple_trees(self):
+    add = utils.nt_tree_fn()(lambda x, y: x + y)
+    out = add((1, [2, (3,)]), (10, [20, (30,)]))
+    self.assertEqual(out, (11, [22, (33,)]))
+    self.assertIsInstance(out[1], list)
+    self.assertIsInstance(out[1][1], tuple)
+
+  def test_leaf_outputs_are_not_traversed(self):
+    pair = utils.nt_tree_fn()(lambda x: (x, x))
+    self.assertEqual(pair([1, 2]), [(1, 1), (2, 2)])
+
+  def test_broadcast_args(self):
+    f = utils.nt_tree_fn(nargs=1)(lambda x, y, z=0: x * y + z)
+    self.assertEqual(f((1, [2, 3]), 10, z=1), (11, [21, 31]))
+
+  def test_mismatched_structures(self):
+    add = utils.nt_tree_fn()(lambda x, y: x + y)
+    for x, y in [((1, 2), [1, 2]),
+                 ((1, 2), (1, 2, 3)),
+                 ((1, (2,)), (1, 2)),
+                 ((1, 2), 1),
+                 (1, (1, 2))]:
+      with self.subTest(x=x, y=y):
+        with self.assertRaisesRegex(TypeError, 'Inconsistent NTTree'):
+          add(x, y)
+
+  def test_tree_structure_argnum(self):
+    f = utils.nt_tree_fn(tree_structure_argnum=0)(lambda x, y: (x, y))
+    self.assertEqual(f((1, 2), ((3, 4), 5)), ((1, (3, 4)), (2, 5)))
+    self.assertEqual(f(1, (3, 4)), (1, (3, 4)))
+
+  def test_reduce(self):
+    is_none = utils.nt_tree_fn(reduce=all)(lambda x: x is None)
+    self.assertTrue(is_none(None))
+    self.assertTrue(is_none((None, [None, (None,)])))
+    self.assertFalse(is_none((None, [None, (1,)])))
+
+    total = utils.nt_tree_fn(reduce=sum)(lambda x: x)
+    self.assertEqual(total((1, [2, (3, 4)], ())), 10)
+
+    first = utils.nt_tree_fn(reduce=lambda x: x[0])(lambda x: x)
+    self.assertEqual(first(([1, 2], 3)), 1)
+
+
+class X1IsX2Test(test_utils.NeuralTangentsTestCase):
+
+  def test_arrays(self):
+    x = jnp.ones((2, 3))
+    self.assertTrue(utils.x1_is_x2(x))
+    self.assertTrue(utils.x1_is_x2(x, x))
+    self.assertTrue(utils.x1_is_x2(x, jnp.ones((2, 3))))
+    self.assertFalse(utils.x1_is_x2(x, x + 1))
+    self.assertFalse(utils.x1_is_x2(x, jnp.ones((3, 2))))
+
+    with self.assertRaises(TypeError):
+      utils.x1_is_x2(1., 1.)
+
+  def test_trees(self):
+    x = jnp.ones((2, 3))
+    for x2, expected in [(None, True),
+                         ((x, [x]), True),
+                         ((x, [jnp.ones((2, 3))]), True),
+                         ((x, [x + 1]), False),
+                         ((x, [jnp.ones((3, 2))]), False)]:
+      with self.subTest(x2=x2):
+        out = utils.x1_is_x2((x, [x]), x2)
+        self.assertIsInstance(out, jnp.ndarray)
+        self.assertEqual(out.shape, ())
+        self.assertEqual(bool(out), expected)
+
+    with self.assertRaisesRegex(TypeError, 'Inconsistent NTTree'):
+      utils.x1_is_x2((x, [x]), (x, x))
+
+
+class CanonicalizeAxisTest(test_utils.NeuralTangentsTestCase):
+
+  def test_canonicalize_axis(self):
+    x = jnp.ones((1, 2, 3, 4))
+    for axis, expected in [(0, [0]),
+                           (-1, [3]),
+                           ((), []),
+                           ((2, 0), [0, 2]),
+                           ((-1, 3, 1, -3), [1, 3]),
+                           ([-4, 3, 0], [0, 3]),
+                           (range(-2, 2), [0, 1, 2, 3]),
+                           ((a for a in (3, -4)), [0, 3])]:
+      with self.subTest(axis=axis):
+        out = utils.canonicalize_axis(axis, x)
+        self.assertEqual(out, expected)
+        self.assertTrue(all(type(a) is int for a in out))
+
+  def test_ndim_or_shape(self):
+    self.assertEqual(utils.canonicalize_axis((-1, 0), 3), [0, 2])
+    self.assertEqual(utils.canonicalize_axis((-1, 0), (5, 6, 7)), [0, 2])
+
+  def test_out_of_bounds(self):
+    for axis in (4, -5, (0, 4)):
+      with self.subTest(axis=axis):
+        with self.assertRaisesRegex(IndexError, 'out of bounds'):
+          utils.canonicalize_axis(axis, 4)
+
+
+class DiagonalBetweenTest(test_utils.NeuralTangentsTestCase):
+
+  def test_diagonal_between(self):
+    key = jax.random.PRNGKey(1)
+    for shape, start_axis, end_axis in [((6, 6), 0, None),
+                                        ((2, 3, 4, 3, 4), 1, None),
+                                        ((3, 4, 3, 4, 5), 0, 4),
+                                        ((5, 2, 3, 2, 3, 2), 1, 5),
+                                        ((2, 3), 1, 1)]:
+      with self.subTest(shape=shape, start_axis=start_axis,
+                        end_axis=end_axis):
+        x = jax.random.normal(key, shape)
+        end = len(shape) if end_axis is None else end_axis
+        half = (end - start_axis) // 2
+        side_shape = shape[start_axis:start_axis + half]
+        side_size = utils.size_at(side_shape)
+
+        # Reference: pick every `(i, i)` element of the flattened halves.
+        x_2d = np.asarray(x).reshape(
+            shape[:start_axis] + (side_size, side_size) + shape[end:])
+        idx = np.arange(side_size)
+        expected = x_2d[(slice(None),) * start_axis + (idx, idx)].reshape(
+            shape[:start_axis] + side_shape + shape[end:])
+
+        diagonal_between = jax.jit(utils.diagonal_between,
+                                   static_argnums=(1, 2))
+        self.assertAllClose(
+            diagonal_between(x, start_axis, end_axis), expected)
+        self.assertAllClose(
+            utils.diagonal_between(x, start_axis, end_axis), expected)
+
+  def test_diagonal_between_is_gather(self):
+    # The diagonal must only read `S` elements of each `S x S` block, rather
+    # than masking and reducing the whole block.
+    x = jnp.ones((4, 8, 8, 8, 8))
+    jaxpr = str(jax.make_jaxpr(
+        lambda x: utils.diagonal_between(x, 1))(x))
+    self.assertIn('gather', jaxpr)
+    self.assertNotIn('reduce_sum', jaxpr)
+
+
+class DataclassTest(test_utils.NeuralTangentsTestCase):
+
+  def _get_kernel(self):
+    return Kernel(
+        nngp=jnp.ones((2, 3)),
+        ntk=None,
+        cov1=jnp.ones((2,)),
+        cov2=jnp.ones((3,)),
+        x1_is_x2=jnp.array(False),
+        is_gaussian=True,
+        is_reversed=False,
+        is_input=False,
+        diagonal_batch=True,
+        diagonal_spatial=False,
+        shape1=(2, 4),
+        shape2=(3, 4),
+        batch_axis=0,
+        channel_axis=1,
+        mask1=None,
+        mask2=jnp.zeros((3,), bool))
+
+  def test_kernel_flatten_unflatten(self):
+    k = self._get_kernel()
+    leaves, treedef = jax.tree_util.tree_flatten(k)
+    self.assertLen(leaves, 5)  # `ntk` and `mask1` are `None`.
+
+    k_new = jax.tree_util.tree_unflatten(treedef, leaves)
+    self.assertIsInstance(k_new, Kernel)
+    self.assertEqual(k_new.asdict().keys(), k.asdict().keys())
+    for f in ('is_gaussian', 'is_reversed', 'is_input', 'diagonal_batch',
+              'diagonal_spatial', 'shape1', 'shape2', 'batch_axis',
+              'channel_axis', 'ntk', 'mask1'):
+      self.assertEqual(getattr(k_new, f), getattr(k, f))
+    self.assertAllClose(k_new.nngp, k.nngp)
+    self.assertAllClose(k_new.mask2, k.mask2)
+
+  def test_kernel_jit(self):
+    k = self._get_kernel()
+
+    @jax.jit
+    def f(k):
+      self.assertTrue(k.is_gaussian)
+      self.assertEqual(k.shape1, (2, 4))
+      return k.replace(nngp=2 * k.nngp, is_gaussian=False)
+
+    k_new = f(k)
+    self.assertIsInstance(k_new, Kernel)
+    self.assertFalse(k_new.is_gaussian)
+    self.assertEqual(k_new.shape2, k.shape2)
+    self.assertAllClose(k_new.nngp, 2 * k.nngp)
+    self.assertAllClose(k_new.cov2, k.cov2)
+
+
+if __name__ == '__main__':
+  absltest.main()